@@ -12,7 +12,7 @@ from textwrap import dedent
 from short_con import constants
 
 from .plan import RenamingPlan
-from .problems import Problem, CONTROLS
+from .problems import CONTROLS, CONTROL_CHOICES
 from .version import __version__
 
 from .utils import (
@@ -862,7 +862,7 @@ class CLI:
         {
             group: 'Problem control',
             names: '--skip',
-            'choices': CON.all_tup + Problem.names_for(CONTROLS.skip),
+            'choices': CONTROL_CHOICES[CONTROLS.skip],
             'nargs': '+',
             'metavar': 'PROB',
             'help': 'Skip items with the named problems',
@@ -870,7 +870,7 @@ class CLI:
         },
         {
             names: '--clobber',
-            'choices': CON.all_tup + Problem.names_for(CONTROLS.clobber),
+            'choices': CONTROL_CHOICES[CONTROLS.clobber],
             'nargs': '+',
             'metavar': 'PROB',
             'help': 'Rename anyway, in spite of named overwriting problems',
@@ -878,7 +878,7 @@ class CLI:
         },
         {
             names: '--create',
-            'choices': CON.all_tup + Problem.names_for(CONTROLS.create),
+            'choices': CONTROL_CHOICES[CONTROLS.create],
             'nargs': '+',
             'metavar': 'PROB',
             'help': 'Fix missing parent problem before renaming',
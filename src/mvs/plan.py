@@ -1,13 +1,14 @@
 import re
-import sys
 import traceback
 
-from copy import deepcopy
-from dataclasses import asdict, replace as clone
-from itertools import groupby
-from os.path import commonprefix
+from collections import Counter
+from dataclasses import replace as clone
+from functools import lru_cache
+from itertools import count, islice, repeat
+from os.path import commonprefix, exists, lexists
 from pathlib import Path
 from short_con import constants
+from types import MappingProxyType
 
 from .utils import (
     MvsError,
@@ -19,11 +20,44 @@ from .utils import (
 
 from .problems import (
     CONTROLS,
+    CONTROL_CHOICES,
     PROBLEM_NAMES as PN,
-    PROBLEM_FORMATS as PF,
     Problem,
 )
 
+####
+# Creating functions from user-supplied code.
+####
+
+@lru_cache(maxsize = 128)
+def compile_user_func(action, user_code, indent):
+    # Takes a CON.code_actions value, the user's code, and an indent size.
+    # Returns the function defined by that code, or raises if the code is
+    # invalid. The function receives the RenamingPlan as an argument rather
+    # than closing over it, so it can be cached and shared across plans.
+
+    # Define the text of the code.
+    func_name = CON.func_name_fmt.format(action)
+    code = CON.user_code_fmt.format(
+        func_name = func_name,
+        user_code = user_code,
+        indent = ' ' * indent,
+    )
+
+    # Create the function via exec() in the context of the globals that
+    # we want to make available to the user's code. The def statement
+    # lands the function in that same dict, so no locals dict is needed.
+    globs = dict(
+        re = re,
+        Path = Path,
+    )
+    exec(compile(code, '<string>', 'exec'), globs)
+    return globs[func_name]
+
+####
+# The renaming plan.
+####
+
 class RenamingPlan:
 
     # Default value for entries in a fake file system.
@@ -87,8 +121,10 @@ class RenamingPlan:
         # Fake file system injected for testing purposes.
         self.file_sys = self.initialize_file_sys(file_sys)
 
-        # Information used when checking RenamePair instance for problems.
-        self.new_groups = None
+        # Information used when checking RenamePair instance for problems:
+        # memoized path-existence results and the counts of new paths.
+        self.exists_cache = {}
+        self.new_counts = None
 
         # Convert the problem-control inputs (skip, clobber, create)
         # into validated tuples of problem names.
@@ -149,26 +185,48 @@ class RenamingPlan:
         # Run various steps that process the RenamePair instances individually:
         # filtering, computing new paths, and validating.
         #
-        # We use the processed_rps() method to execute the step, handle
+        # We use the processed_rps() method to execute the steps, handle
         # problems appropriately, and yield a potentially-filtered collection
         # of potentially-modified RenamePair instances.
         #
-        rp_steps = (
-            (None, self.execute_user_filter),
-            (None, self.execute_user_rename),
-            (None, self.check_orig_exists),
-            (None, self.check_orig_new_differ),
-            (None, self.check_new_not_exists),
-            (None, self.check_new_parent_exists),
-            (self.prepare_new_groups, self.check_new_collisions),
+        # The steps are organized into passes over self.rps. A pass can
+        # run several steps, which processed_rps() applies to each
+        # RenamePair in turn. Separate passes are needed when a step
+        # depends on the outcome of the prior steps across all rps:
+        #
+        # - Renaming: the user's code sees the sequence numbers and common
+        #   prefix of the RenamePair instances that survived filtering.
+        #
+        # - Collisions: they depend on the new paths of all survivors.
+        #
+        # The passes that can run the user's code first compute the
+        # common-prefix, which that code can use. The collision pass
+        # does not need it.
+        #
+        # The steps that run the user's code are included only if the
+        # user supplied such code, so they never need to check for it.
+        filter_steps = (self.execute_user_filter,) if self.filter_func else ()
+        rename_steps = (self.execute_user_rename,) if self.rename_func else ()
+        prepare_prefix = self.prepare_prefix_len
+        rp_passes = (
+            (prepare_prefix, filter_steps),
+            (prepare_prefix, rename_steps + (
+                self.check_orig_exists,
+                self.check_orig_new_differ,
+                self.check_new_not_exists,
+                self.check_new_parent_exists,
+            )),
+            (self.prepare_new_counts, (self.check_new_collisions,)),
         )
-        for prep_step, step in rp_steps:
-            # Run any needed preparations and then the step.
-            if prep_step:
-                prep_step()
-            self.rps = tuple(self.processed_rps(step))
+        for prep_step, steps in rp_passes:
+            # Run any needed preparations and then the steps. A pass is
+            # skipped if it has no steps or if its preparation returns
+            # false to indicate that there is no work to do.
+            if not steps or (prep_step and not prep_step()):
+                continue
+            self.rps = tuple(self.processed_rps(*steps))
 
-            # Register problem if the step filtered out everything.
+            # Register problem if the pass filtered out everything.
             if not self.rps:
                 p = Problem(PN.all_filtered)
                 self.handle_problem(p)
@@ -191,28 +249,38 @@ class RenamingPlan:
             self.handle_problem(p)
             return ()
 
-        # If we have rename_code, inputs are just original paths.
-        if self.rename_code:
-            rps = tuple(
-                RenamePair(orig, None)
-                for orig in self.inputs
-                if orig
-            )
+        # Helper to return a tuple of RenamePair instances, or
+        # register a Problem if it is empty.
+        def do_return(rps):
             if rps:
                 return rps
             else:
                 return do_fail(PN.parsing_no_paths)
 
+        # If we have rename_code, inputs are just original paths.
+        # Here and below, we build the RenamePair instances via map(),
+        # which drives the iteration from C.
+        if self.rename_code:
+            origs = filter(None, self.inputs)
+            return do_return(tuple(map(RenamePair, origs, repeat(None))))
+
         # Otherwise, organize inputs into original paths and new paths.
         if self.structure == STRUCTURES.paragraphs:
             # Paragraphs: first original paths, then new paths.
-            # - Group into non-empty vs empty lines.
-            # - Ensure exactly two groups of non-empty.
-            groups = [
-                list(lines)
-                for g, lines in groupby(self.inputs, key = bool)
-                if g
-            ]
+            # - Scan once, starting a group at each non-empty line that
+            #   follows an empty one (or the start of input).
+            # - Ensure exactly two groups of non-empty, stopping early
+            #   if a third group starts.
+            groups = []
+            prev = ''
+            for line in self.inputs:
+                if line:
+                    if not prev:
+                        if len(groups) == 2:
+                            return do_fail(PN.parsing_paragraphs)
+                        groups.append([])
+                    groups[-1].append(line)
+                prev = line
             if len(groups) == 2:
                 origs, news = groups
             else:
@@ -220,30 +288,44 @@ class RenamingPlan:
 
         elif self.structure == STRUCTURES.pairs:
             # Pairs: original path, new path, original path, etc.
-            groups = [[], []]
-            for i, line in enumerate(self.inputs):
-                if line:
-                    groups[i % 2].append(line)
-            origs, news = groups
+            # Blank lines are ignored. The RenamePair instances are
+            # built directly by mapping over a single iterator twice.
+            paths = list(filter(None, self.inputs))
+            if len(paths) % 2:
+                return do_fail(PN.parsing_imbalance)
+            else:
+                it = iter(paths)
+                return do_return(tuple(map(RenamePair, it, it)))
 
         elif self.structure == STRUCTURES.rows:
             # Rows: original-new path pairs, as tab-delimited rows.
-            origs = []
-            news = []
+            # The RenamePair instances are built directly from the cells.
+            # Partitioning on the first tab avoids a list per row: the row
+            # is valid if both cells are non-empty and the new path has no
+            # further tab.
+            rps = []
+            tab = CON.tab
             for row in self.inputs:
                 if row:
-                    cells = row.split(CON.tab)
-                    if len(cells) == 2 and all(cells):
-                        origs.append(cells[0])
-                        news.append(cells[1])
+                    orig, _, new = row.partition(tab)
+                    if orig and new and tab not in new:
+                        rps.append(RenamePair(orig, new))
                     else:
                         return do_fail(PN.parsing_row, row)
+            return do_return(tuple(rps))
 
         else:
             # Flat: like paragraphs without the blank-line delimiter.
-            paths = [line for line in self.inputs if line]
-            i = len(paths) // 2
-            origs, news = (paths[0:i], paths[i:])
+            # The RenamePair instances are built directly from the two
+            # halves, without slicing them into new lists.
+            paths = list(filter(None, self.inputs))
+            h, odd = divmod(len(paths), 2)
+            if odd:
+                return do_fail(PN.parsing_imbalance)
+            else:
+                origs = islice(paths, h)
+                news = islice(paths, h, None)
+                return do_return(tuple(map(RenamePair, origs, news)))
 
         # Problem if we got no paths or unequal original vs new.
         if not origs and not news:
@@ -252,10 +334,7 @@ class RenamingPlan:
             return do_fail(PN.parsing_imbalance)
 
         # Return the RenamePair instances.
-        return tuple(
-            RenamePair(orig, new)
-            for orig, new in zip(origs, news)
-        )
+        return tuple(map(RenamePair, origs, news))
 
     ####
     # Creating the user-defined functions for filtering and renaming.
@@ -271,25 +350,10 @@ class RenamingPlan:
         if callable(user_code):
             return user_code
 
-        # Define the text of the code.
-        func_name = CON.func_name_fmt.format(action)
-        code = CON.user_code_fmt.format(
-            func_name = func_name,
-            user_code = user_code,
-            indent = ' ' * self.indent,
-        )
-
-        # Create the function via exec() in the context of:
-        # - Globals that we want to make available to the user's code.
-        # - A locals dict that we can use to return the generated function.
-        globs = dict(
-            re = re,
-            Path = Path,
-        )
-        locs = {}
+        # Get the function, which is cached across plans. If the code is
+        # invalid, register a Problem.
         try:
-            exec(code, globs, locs)
-            return locs[func_name]
+            return compile_user_func(action, user_code, self.indent)
         except Exception as e:
             msg = traceback.format_exc(limit = 0)
             p = Problem(PN.user_code_exec, msg)
@@ -300,86 +364,96 @@ class RenamingPlan:
     # A method to execute the steps that process RenamePair instance individually.
     ####
 
-    def processed_rps(self, step):
-        # Takes a "step", which is a RenamingPlan method.
-        # Executes that method for each RenamePair.
+    def processed_rps(self, *steps):
+        # Takes one or more "steps", which are RenamingPlan methods.
+        # Executes those methods, in order, for each RenamePair.
         # Yields potentially-modified RenamePair instances,
         # handling problems along the way.
 
-        # Prepare common-prefix and sequence numbering, which might
-        # be used by the user-suppled renaming/filtering code.
-        self.prefix_len = self.compute_prefix_len()
+        # Prepare sequence numbering, which might be used by the
+        # user-suppled renaming/filtering code.
         seq = self.compute_sequence_iterator()
-
-        for rp in self.rps:
-            # The step() call returns a potentially-modified
-            # RenamePair instance or a Problem instance.
-            #
-            # - orig: never modified.
-            # - new: set based on the user's renaming code.
-            # - exclude: set true if user's filtering code rejected the instance.
-            # - create_parent: can be set here if a controlled problem occurred.
-            # - clobber: ditto.
-            #
-
-            # Execute the step. If we get a Problem, handle it.
-            # Otherwise, set rp to the returned RenamePair.
-            result = step(rp, next(seq))
-            if isinstance(result, Problem):
-                control = self.handle_problem(result, rp = rp)
+        handle_problem = self.handle_problem
+
+        for rp, seq_val in zip(self.rps, seq):
+            for step in steps:
+                # Each step() call returns None, a modified
+                # RenamePair instance, or a Problem instance.
+                #
+                # - orig: never modified.
+                # - new: set based on the user's renaming code.
+                # - exclude: set true if user's filtering code rejected the instance.
+                # - create_parent: can be set here if a controlled problem occurred.
+                # - clobber: ditto.
+                #
+                result = step(rp, seq_val)
+                if result is None:
+                    # No change.
+                    continue
+                elif not result.IS_PROBLEM:
+                    # A modified RenamePair, which replaces rp. Stop if it
+                    # was filtered out by the user's code.
+                    rp = result
+                    if rp.exclude:
+                        break
+                    else:
+                        continue
+
+                # Handle the Problem and act based on the problem-control.
+                control = handle_problem(result, rp = rp)
+                if control == CONTROLS.skip:
+                    # Skip RenamePair because a problem occurred, but proceed with others.
+                    break
+                elif control == CONTROLS.clobber:
+                    # During renaming, the RenamePair will overwrite something.
+                    rp = clone(rp, clobber = True)
+                elif control == CONTROLS.create:
+                    # The RenamePair lacks a parent, but we will create it before renaming.
+                    rp = clone(rp, create_parent = True)
+                else:
+                    # An uncontrolled problem: the plan has failed. Keep the
+                    # RenamePair, but skip its remaining steps.
+                    yield rp
+                    break
             else:
-                control = None
-                rp = result
-
-            # Act based on the problem-control and the rp.
-            if control == CONTROLS.skip:
-                # Skip RenamePair because a problem occurred, but proceed with others.
-                continue
-            elif control == CONTROLS.clobber:
-                # During renaming, the RenamePair will overwrite something.
-                yield clone(rp, clobber = True)
-            elif control == CONTROLS.create:
-                # The RenamePair lacks a parent, but we will create it before renaming.
-                yield clone(rp, create_parent = True)
-            elif not rp.exclude:
-                # No problem: yield unless filtered out by user's code.
+                # No problem: the RenamePair passed every step.
                 yield rp
 
     ####
     # The steps that process RenamePair instance individually.
-    # Each step returns a Problem, the orignal RenamePair, or
-    # a modified RenamePair.
+    # Each step returns None if the RenamePair passes unchanged, a
+    # modified RenamePair, or a Problem. Returning None keeps the common
+    # case free of allocations and type checks.
     ####
 
     def execute_user_filter(self, rp, seq_val):
-        if self.filter_code:
-            try:
-                result = self.filter_func(rp.orig, Path(rp.orig), seq_val, self)
-                return rp if result else clone(rp, exclude = True)
-            except Exception as e:
-                return Problem(PN.filter_code_invalid, e, rp.orig)
-        else:
-            return rp
+        # Only the user's code runs inside the try-except.
+        try:
+            keep = bool(self.filter_func(rp.orig, Path(rp.orig), seq_val, self))
+        except Exception as e:
+            return Problem(PN.filter_code_invalid, e, rp.orig)
+        # The user-code steps run before any problem-control can set a
+        # flag on the RenamePair, so the modified instance can be built
+        # directly, which is cheaper than clone().
+        return None if keep else RenamePair(rp.orig, rp.new, exclude = True)
 
     def execute_user_rename(self, rp, seq_val):
-        if self.rename_code:
-            # Compute the new path.
-            try:
-                new = self.rename_func(rp.orig, Path(rp.orig), seq_val, self)
-            except Exception as e:
-                return Problem(PN.rename_code_invalid, e, rp.orig)
-            # Validate its type and return a modified RenamePair instance.
-            if isinstance(new, (str, Path)):
-                return clone(rp, new = str(new))
-            else:
-                typ = type(new).__name__
-                return Problem(PN.rename_code_bad_return, typ, rp.orig)
+        # Compute the new path.
+        try:
+            new = self.rename_func(rp.orig, Path(rp.orig), seq_val, self)
+        except Exception as e:
+            return Problem(PN.rename_code_invalid, e, rp.orig)
+        # Validate its type and return a modified RenamePair instance,
+        # built directly as in execute_user_filter().
+        if isinstance(new, (str, Path)):
+            return RenamePair(rp.orig, str(new))
         else:
-            return rp
+            typ = type(new).__name__
+            return Problem(PN.rename_code_bad_return, typ, rp.orig)
 
     def check_orig_exists(self, rp, seq_val):
         if self.path_exists(rp.orig):
-            return rp
+            return None
         else:
             return Problem(PN.missing)
 
@@ -387,34 +461,34 @@ class RenamingPlan:
         if rp.equal:
             return Problem(PN.equal)
         else:
-            return rp
+            return None
 
     def check_new_not_exists(self, rp, seq_val):
         # The problem is conditional on ORIG and NEW being different
         # to avoid pointless reporting of multiple problems in cases
         # where ORIG does not exist and where it equals NEW.
-        if self.path_exists(rp.new) and not rp.equal:
+        if not rp.equal and self.path_exists(rp.new):
             return Problem(PN.existing)
         else:
-            return rp
+            return None
 
     def check_new_parent_exists(self, rp, seq_val):
-        if self.path_exists(Path(rp.new).parent):
-            return rp
+        if self.path_exists(Path(rp.new).parent, follow_symlinks = True):
+            return None
         else:
             return Problem(PN.parent)
 
-    def prepare_new_groups(self):
+    def prepare_new_counts(self):
         # A preparation-step for check_new_collisions().
-        # Organize rps into dict-of-list, keyed by the new path.
-        self.new_groups = {}
-        for rp in self.rps:
-            self.new_groups.setdefault(rp.new, []).append(rp)
+        # Count the rps for each new path. The counting loop runs in C.
+        # Returns true if there are any collisions. If not, every count
+        # is 1 and the collision pass can be skipped entirely.
+        self.new_counts = Counter(rp.new for rp in self.rps)
+        return len(self.new_counts) < len(self.rps)
 
     def check_new_collisions(self, rp, seq_val):
-        g = self.new_groups[rp.new]
-        if len(g) == 1:
-            return rp
+        if self.new_counts[rp.new] == 1:
+            return None
         else:
             return Problem(PN.colliding)
 
@@ -437,11 +511,11 @@ class RenamingPlan:
             return ()
 
         # Check that the problem names are valid for the given control.
-        all_choices = Problem.names_for(control)
+        choices = CONTROL_CHOICES[control]
         invalid = tuple(
             nm
             for nm in pnames
-            if not (nm in all_choices or nm == CON.all)
+            if nm not in choices
         )
 
         # Either raise or return the validated tuple of problem names.
@@ -450,15 +524,15 @@ class RenamingPlan:
             msg = MF.invalid_control.format(control, pn)
             raise MvsError(msg)
         elif CON.all in pnames:
-            return all_choices
+            return Problem.names_for(control)
         else:
             return tuple(pnames)
 
     def build_control_lookup(self):
         # Uses the tuples in self.skip, self.create, and self.clobber to return
-        # a dict mapping each Problem name that the user wants to control to
-        # the desired control mechanism. Raises if the user tries to control
-        # the same Problem in different ways.
+        # a read-only mapping of each Problem name that the user wants to
+        # control to the desired control mechanism. Raises if the user tries
+        # to control the same Problem in different ways.
         lookup = {}
         for c in CONTROLS.keys():
             for pname in getattr(self, c):
@@ -467,7 +541,7 @@ class RenamingPlan:
                     raise MvsError(msg)
                 else:
                     lookup[pname] = c
-        return lookup
+        return MappingProxyType(lookup)
 
     def handle_problem(self, p, rp = None):
         # Takes a Problem and optionally a RenamePair.
@@ -495,10 +569,16 @@ class RenamingPlan:
     ####
 
     def compute_sequence_iterator(self):
-        return iter(range(self.seq_start, sys.maxsize, self.seq_step))
+        return count(self.seq_start, self.seq_step)
+
+    def prepare_prefix_len(self):
+        # A preparation-step for the passes that can run user code, which
+        # sees the common-prefix via plan.prefix_len and strip_prefix().
+        self.prefix_len = self.compute_prefix_len()
+        return True
 
     def compute_prefix_len(self):
-        origs = tuple(rp.orig for rp in self.rps)
+        origs = [rp.orig for rp in self.rps]
         return len(commonprefix(origs))
 
     def strip_prefix(self, orig):
@@ -515,29 +595,49 @@ class RenamingPlan:
         # to hold additional information.
         #
         # We build an independent copy of the file system because
-        # the rename_paths() method will modify the dict.
+        # the rename_paths() method will modify the dict. The paths are
+        # normalized to str, because path_exists() looks them up by str.
+        # A shallow copy suffices: rename_paths() moves the values to new
+        # keys but never modifies them.
         if file_sys is None:
             return None
         elif isinstance(file_sys, dict):
-            return deepcopy(file_sys)
+            return {
+                str(path) : val
+                for path, val in file_sys.items()
+            }
         else:
             try:
                 return {
-                    path : self.DEFAULT_FILE_SYS_VAL
+                    str(path) : self.DEFAULT_FILE_SYS_VAL
                     for path in file_sys
                 }
             except Exception as e:
                 raise MvsError.new(e, msg = MF.invalid_file_sys)
 
-    def path_exists(self, p):
+    def path_exists(self, p, follow_symlinks = False):
+        p = str(p)
         if self.file_sys is None:
-            # Check the real file system.
-            return Path(p).exists()
+            # Check the real file system. The checks on original paths, new
+            # paths, and new parents overlap heavily (eg, sibling paths share
+            # a parent), and prepare() runs only once, so we memoize the
+            # results, keyed by str and by the symlink semantics.
+            #
+            # By default we use lexists(): a bare lstat() call that treats
+            # OSError as absence, so a dangling symlink counts as existing,
+            # which is right for the original and new paths. A parent
+            # directory must be usable, so that check follows symlinks.
+            key = (p, follow_symlinks)
+            result = self.exists_cache.get(key)
+            if result is None:
+                result = exists(p) if follow_symlinks else lexists(p)
+                self.exists_cache[key] = result
+            return result
         else:
             # Or check the fake file system added for testing purposes.
-            # In this context, assume that '.' always exists so that the
+            # It is already a dict, so it needs no memoizing. In this
+            # context, assume that '.' always exists so that the
             # user/tester does not have to include explicitly.
-            p = str(p)
             return p in self.file_sys or p == '.'
 
     def rename_paths(self):
@@ -617,12 +717,12 @@ class RenamingPlan:
             # Other.
             prefix_len = self.prefix_len,
             rename_pairs = [
-                asdict(rp)
+                rp.as_dict
                 for rp in self.rps
             ],
             tracking_index = self.tracking_index,
             problems = {
-                control : [asdict(p) for p in ps]
+                control : [p.as_dict for p in ps]
                 for control, ps in self.problems.items()
             },
         )
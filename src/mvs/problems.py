@@ -1,7 +1,13 @@
-from dataclasses import dataclass, field
-from short_con import constants, cons
+from dataclasses import dataclass
+from short_con import constants
 
-from .utils import RenamePair
+try:
+    from functools import cached_property
+except ImportError: # pragma: no cover
+    # Python 3.7.
+    cached_property = property
+
+from .utils import CON, RenamePair
 
 ####
 # Problem names and associated messages/formats.
@@ -63,6 +69,14 @@ CONTROLLABLES = {
     CONTROLS.create:  (PN.parent,),
 }
 
+# The valid choices for each control: its controllable problem names
+# plus the "all" shortcut. Used by RenamingPlan and the command-line
+# options, so we build them once here.
+CONTROL_CHOICES = {
+    control : CON.all_tup + pnames
+    for control, pnames in CONTROLLABLES.items()
+}
+
 ####
 # Data object to represent a problem.
 ####
@@ -73,6 +87,9 @@ class Problem:
     msg: str
     rp : RenamePair = None
 
+    # See RenamePair.IS_PROBLEM.
+    IS_PROBLEM = True
+
     def __init__(self, name, *xs, msg = None, rp = None):
         # Custom initializer, because we need a convenience lookup to build
         # the ultimate message, given a problem name and arguments.
@@ -82,13 +99,25 @@ class Problem:
         d['msg'] = msg or self.format_for(name).format(*xs)
         d['rp'] = rp
 
-    @property
+    @cached_property
     def formatted(self):
+        # Problem instances are frozen, so the formatted text is computed
+        # at most once. It lands in __dict__, outside the dataclass fields.
         if self.rp is None:
             return self.msg
         else:
             return f'{self.msg}:\n{self.rp.formatted}'
 
+    @property
+    def as_dict(self):
+        # See RenamePair.as_dict.
+        rp = self.rp
+        return dict(
+            name = self.name,
+            msg = self.msg,
+            rp = None if rp is None else rp.as_dict,
+        )
+
     @classmethod
     def format_for(cls, name):
         return PROBLEM_FORMATS[name]
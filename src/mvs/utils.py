@@ -1,4 +1,5 @@
 import pyperclip
+import sys
 
 from dataclasses import dataclass
 from kwexception import Kwexception
@@ -6,7 +7,6 @@ from pathlib import Path
 from short_con import constants
 from subprocess import run
 from tempfile import gettempdir
-from textwrap import dedent
 from time import time
 
 from .version import __version__
@@ -108,9 +108,16 @@ class MvsError(Kwexception):
 
 ####
 # A dataclass to hold a pair of paths: original and corresponding new.
+#
+# A RenamingPlan holds one RenamePair per input path, so we want the
+# instances to be slotted. Dataclasses support that directly in
+# Python 3.10+. On older versions we just use a regular dataclass,
+# because manual __slots__ conflict with the field defaults.
 ####
 
-@dataclass(frozen = True)
+DATACLASS_SLOTS = dict(slots = True) if sys.version_info >= (3, 10) else {}
+
+@dataclass(frozen = True, **DATACLASS_SLOTS)
 class RenamePair:
     # A data object to hold an original path and the corresponding new path.
     orig: str
@@ -119,6 +126,10 @@ class RenamePair:
     create_parent: bool = False
     clobber: bool = False
 
+    # RenamingPlan steps return either a RenamePair or a Problem.
+    # This class attribute lets the plan tell them apart cheaply.
+    IS_PROBLEM = False
+
     @property
     def equal(self):
         return self.orig == self.new
@@ -127,6 +138,18 @@ class RenamePair:
     def formatted(self):
         return f'{self.orig}\n{self.new}\n'
 
+    @property
+    def as_dict(self):
+        # Built directly rather than via dataclasses.asdict(), which
+        # recurses into each field and deep-copies it.
+        return dict(
+            orig = self.orig,
+            new = self.new,
+            exclude = self.exclude,
+            create_parent = self.create_parent,
+            clobber = self.clobber,
+        )
+
 ####
 # Read/write: files, clipboard.
 ####
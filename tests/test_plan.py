@@ -1,5 +1,7 @@
 import pytest
+import shutil
 from itertools import chain
+from pathlib import Path
 
 # Top-level package imports.
 from mvs import RenamingPlan, MvsError, __version__
@@ -73,6 +75,15 @@ def test_structure_default(tr):
         plan.rename_paths()
         assert tuple(plan.file_sys) == news
 
+    # Odd number of paths: should fail.
+    plan = RenamingPlan(
+        inputs = origs + news[:-1],
+        file_sys = origs,
+    )
+    with pytest.raises(MvsError) as einfo:
+        plan.rename_paths()
+    assert_failed_because(einfo, plan, PN.parsing_imbalance)
+
 def test_structure_paragraphs(tr):
     # Paths.
     origs = ('a', 'b', 'c')
@@ -133,6 +144,15 @@ def test_structure_pairs(tr):
     plan.rename_paths()
     assert tuple(plan.file_sys) == news
 
+    # Blank lines are ignored, so their count does not matter.
+    plan = RenamingPlan(
+        inputs = inputs[:3] + ('',) + inputs[3:],
+        structure = STRUCTURES.pairs,
+        file_sys = origs,
+    )
+    plan.rename_paths()
+    assert tuple(plan.file_sys) == news
+
     # Odd number of paths: should fail.
     plan = RenamingPlan(
         inputs = inputs[:-1],
@@ -159,8 +179,8 @@ def test_structure_rows(tr):
     plan.rename_paths()
     assert tuple(plan.file_sys) == news
 
-    # Invalid rows with empty cells, an odd number, or both.
-    for bad_row in ('c\t', 'c\t\t\tc1', 'c\tc1\t\t'):
+    # Invalid rows with empty cells, the wrong number, or both.
+    for bad_row in ('c', 'c\t', 'c\t\t\tc1', 'c\tc1\t\t', 'c\tc1\tc2'):
         plan = RenamingPlan(
             inputs = inputs[:-1] + (bad_row,),
             structure = STRUCTURES.rows,
@@ -284,6 +304,21 @@ def test_code_execution_fails(tr):
     )
     do_checks(plan, PN.filter_code_invalid)
 
+def test_user_code_cached(tr):
+    # Plans with the same user code share the function created from it.
+    origs = ('a', 'b', 'c')
+    plans = [
+        RenamingPlan(
+            inputs = origs,
+            rename_code = 'return o + o',
+            file_sys = origs,
+        )
+        for _ in range(2)
+    ]
+    for plan in plans:
+        plan.prepare()
+    assert plans[0].rename_func is plans[1].rename_func
+
 def test_seq(tr):
     # User defines a sequence and uses its values in user-supplied code.
     origs = ('a', 'b', 'c')
@@ -309,6 +344,28 @@ def test_common_prefix(tr):
     )
     plan.rename_paths()
     assert tuple(plan.file_sys) == exp_file_sys
+    assert plan.prefix_len == len('blah-')
+
+    # User-supplied code can also read plan.prefix_len directly.
+    plan = RenamingPlan(
+        inputs = origs[0:2],
+        rename_code = 'return o[plan.prefix_len:] + "1"',
+        file_sys = origs[0:2],
+    )
+    plan.rename_paths()
+    assert tuple(plan.file_sys) == ('a1', 'b1')
+
+    # The collision pass runs no user code, so it keeps the prefix.
+    plan = RenamingPlan(
+        inputs = origs,
+        rename_code = 'return "x" if o[-1] in "ab" else plan.strip_prefix(o)',
+        file_sys = origs,
+        skip = PN.colliding,
+    )
+    plan.rename_paths()
+    assert tuple(plan.file_sys) == ('blah-a', 'blah-b', 'c')
+    assert plan.prefix_len == len('blah-')
+    assert plan.as_dict['prefix_len'] == len('blah-')
 
 ####
 # RenamingPlan data.
@@ -346,6 +403,14 @@ def test_file_sys_arg(tr):
     assert plan.file_sys == file_sys
     assert plan.file_sys is not file_sys
 
+    # Pass file_sys as Path instances: they are stored as str.
+    plan = RenamingPlan(
+        inputs = origs + news,
+        structure = STRUCTURES.flat,
+        file_sys = [Path(o) for o in origs],
+    )
+    assert plan.file_sys == file_sys
+
     # Pass non-iterable as a file_sys.
     with pytest.raises(MvsError) as einfo:
         plan = RenamingPlan(
@@ -638,6 +703,14 @@ def test_new_parent_missing(tr):
     got = tuple(path.replace('\\', '/') for path in plan.file_sys) # Temp Windows fix.
     assert got == exp_file_sys2
 
+    # The parent is normalized like Path.parent: '.' components do not count.
+    plan = RenamingPlan(
+        inputs = ('o', 'x/./a'),
+        file_sys = ('o', 'x'),
+    )
+    plan.prepare()
+    assert not plan.failed
+
 def test_news_collide(tr):
     # Paths.
     origs = ('a', 'b', 'c')
@@ -701,3 +774,58 @@ def test_failures_skip_all(tr):
         plan.rename_paths()
     assert_failed_because(einfo, plan, PN.all_filtered)
 
+def test_real_file_sys_dangling_symlink(tr):
+    # On the real file system, a dangling symlink exists for renaming
+    # purposes: it can be renamed, and it blocks a new path.
+    origs, news, extras = tr.temp_area(('a',), ('a1',), extras = ('b',))
+    link = origs[0]
+    Path(link).unlink()
+    try:
+        Path(link).symlink_to('does-not-exist')
+    except (OSError, NotImplementedError):
+        pytest.skip('Symlinks are not available')
+    try:
+        plan = RenamingPlan(inputs = origs + extras)
+        plan.prepare()
+        assert plan.failed
+        assert plan.uncontrolled_problems[0].name == PN.existing
+        plan = RenamingPlan(inputs = origs + news)
+        plan.rename_paths()
+        assert Path(news[0]).is_symlink()
+
+        # But a parent directory that is a dangling symlink does not exist.
+        new = f'{news[0]}/b'
+        plan = RenamingPlan(inputs = extras + (new,))
+        plan.prepare()
+        assert plan.failed
+        assert plan.uncontrolled_problems[0].name == PN.parent
+    finally:
+        # Clean up the work area, which holds a dangling symlink.
+        shutil.rmtree(tr.WORK_AREA_ROOT, ignore_errors = True)
+
+def test_checks_report_problems_together(tr):
+    # The checks on RenamePair instances run in a single pass, so problems
+    # of different kinds are reported together, one per RenamePair.
+    origs = ('a', 'b', 'c')
+    news = ('a', 'b1', 'c1')
+    plan = RenamingPlan(
+        inputs = origs + news,
+        structure = STRUCTURES.flat,
+        file_sys = origs[0:2] + news[1:2],
+    )
+    plan.prepare()
+    assert plan.failed
+    got = sorted(p.name for p in plan.uncontrolled_problems)
+    assert got == sorted((PN.equal, PN.existing, PN.missing))
+
+    # Renaming runs in the same pass as the checks: the new paths computed
+    # by the user's code are checked immediately.
+    plan = RenamingPlan(
+        inputs = origs,
+        rename_code = 'return o if o == "a" else o + "1"',
+        file_sys = origs[0:2] + news[1:2],
+    )
+    plan.prepare()
+    assert plan.failed
+    got = sorted(p.name for p in plan.uncontrolled_problems)
+    assert got == sorted((PN.equal, PN.existing, PN.missing))
@@ -1,9 +1,21 @@
 import pytest
 
-from mvs.utils import RenamePair
+from dataclasses import asdict
+
+from mvs.utils import RenamePair, DATACLASS_SLOTS
 
 def test_rename_pair(tr):
     rp = RenamePair('a', 'b')
     assert rp.orig == 'a'
     assert rp.new == 'b'
 
+def test_rename_pair_slots(tr):
+    # Where supported, RenamePair instances have no __dict__.
+    rp = RenamePair('a', 'b')
+    if DATACLASS_SLOTS:
+        assert not hasattr(rp, '__dict__')
+
+def test_rename_pair_as_dict(tr):
+    # RenamePair.as_dict agrees with dataclasses.asdict.
+    for rp in (RenamePair('a', 'b'), RenamePair('a', None, clobber = True)):
+        assert rp.as_dict == asdict(rp)